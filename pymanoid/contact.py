@@ -17,15 +17,112 @@
 # You should have received a copy of the GNU General Public License along with
 # pymanoid. If not, see <http://www.gnu.org/licenses/>.
 
-from numpy import array, ndarray
-from numpy import cross, diag, dot, eye, hstack, sqrt, vstack, zeros
-from scipy.linalg import block_diag
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import json
+
+from numpy import arange, array, array_equal, cross, diag, dot, empty, eye
+from numpy import hstack, ndarray, repeat, sqrt, tile, vstack, zeros
 
 from .body import Box
 from .pypoman import compute_cone_face_matrix, compute_polygon_hull
 from .pypoman import project_polytope
 from .qpsolvers import solve_qp
-from .transformations import crossmat
+from .sim import gravity_const
+
+
+def _block_diag(blocks):
+    """
+    Block-diagonal matrix from a stack of blocks of the same shape.
+    """
+    nb_blocks, m, n = blocks.shape
+    M = zeros((nb_blocks, m, nb_blocks, n))
+    diag_ids = arange(nb_blocks)
+    M[diag_ids, :, diag_ids, :] = blocks
+    return M.reshape((nb_blocks * m, nb_blocks * n))
+
+
+def _crossmat_into(x, out):
+    """
+    Write the cross-product matrix of `x` into a (3, 3) array `out` whose
+    diagonal is already zero, without allocating a new matrix. If `x` is a
+    (3, N) array of vectors, `out` has shape (3, 3, N).
+    """
+    out[0, 1], out[0, 2] = -x[2], +x[1]
+    out[1, 0], out[1, 2] = +x[2], -x[0]
+    out[2, 0], out[2, 1] = -x[1], +x[0]
+
+
+def _force_span(R, mu):
+    """
+    Span matrix of a force friction pyramid with orientation `R`.
+    """
+    return dot(R, array([
+        [+mu, +mu, -mu, -mu],
+        [+mu, -mu, +mu, -mu],
+        [+1, +1, +1, +1]]))
+
+
+def _grasp_matrix(arm):
+    """
+    Grasp matrix moving a wrench by the lever arm `arm`.
+    """
+    G = eye(6)
+    _crossmat_into(arm, G[3:, :3])
+    return G
+
+
+def _grasp_matrices(arms):
+    """
+    Horizontal stack of the grasp matrices for lever arms given as the rows
+    of an (N, 3) array.
+    """
+    nb_arms = arms.shape[0]
+    G = tile(eye(6), (1, nb_arms))
+    blocks = G.reshape((6, nb_arms, 6))[3:, :, :3].transpose((0, 2, 1))
+    _crossmat_into(arms.T, blocks)
+    return G
+
+
+def _local_wrench_cone(X, Y, mu):
+    """
+    Wrench friction cone of a rectangular contact area in the contact frame.
+    """
+    return array([
+        # fx fy             fz taux tauy tauz
+        [-1,  0,           -mu,   0,   0,   0],
+        [+1,  0,           -mu,   0,   0,   0],
+        [0,  -1,           -mu,   0,   0,   0],
+        [0,  +1,           -mu,   0,   0,   0],
+        [0,   0,            -Y,  -1,   0,   0],
+        [0,   0,            -Y,  +1,   0,   0],
+        [0,   0,            -X,   0,  -1,   0],
+        [0,   0,            -X,   0,  +1,   0],
+        [-Y, -X, -(X + Y) * mu, +mu, +mu,  -1],
+        [-Y, +X, -(X + Y) * mu, +mu, -mu,  -1],
+        [+Y, -X, -(X + Y) * mu, -mu, +mu,  -1],
+        [+Y, +X, -(X + Y) * mu, -mu, -mu,  -1],
+        [+Y, +X, -(X + Y) * mu, +mu, +mu,  +1],
+        [+Y, -X, -(X + Y) * mu, +mu, -mu,  +1],
+        [-Y, +X, -(X + Y) * mu, -mu, +mu,  +1],
+        [-Y, -X, -(X + Y) * mu, -mu, -mu,  +1]])
+
+
+def _wrench_span(R, X, Y, mu):
+    """
+    Span matrix of the wrench friction cone of a rectangular contact area
+    with orientation `R`, taken at the center of the area.
+    """
+    # column 4 * i + j is the j-th force ray applied at vertex i
+    forces = tile(_force_span(R, mu), (1, 4))
+    arms = repeat(dot(R, array([
+        [+X, +X, -X, -X],
+        [+Y, -Y, -Y, +Y],
+        [0., 0., 0., 0.]])), 4, axis=1)
+    return vstack([forces, cross(arms, forces, axis=0)])
 
 
 class Contact(Box):
@@ -62,6 +159,15 @@ class Contact(Box):
     def __init__(self, shape, pos=None, rpy=None, pose=None, friction=None,
                  link=None, slab_thickness=0.01):
         X, Y = shape
+        self.__F = None
+        self.__R = None
+        self.__RT = None
+        self.__T = None
+        self.__force_inequalities = None
+        self.__force_span = None
+        self.__local_cone = None
+        self.__wrench_hrep = None
+        self.__wrench_span = None
         super(Contact, self).__init__(
             X, Y, Z=slab_thickness, pos=pos, rpy=rpy, pose=pose, color='r',
             dZ=-slab_thickness)
@@ -93,6 +199,70 @@ class Contact(Box):
             contact_copy.hide()
         return contact_copy
 
+    def __check_pose(self):
+        """
+        Reset pose-dependent matrices if the contact has moved since they were
+        computed. The transform is compared directly rather than hooked in
+        setters, as contacts can also be moved from the GUI.
+        """
+        T = self.T
+        if self.__T is None or not array_equal(T, self.__T):
+            self.__reset_cache()
+            self.__R = T[:3, :3]
+            self.__RT = self.__R.T.copy()  # contiguous for matrix products
+            self.__T = T
+
+    def __reset_cache(self):
+        """
+        Reset cached world-frame matrices.
+        """
+        self.__F = None
+        self.__force_inequalities = None
+        self.__force_span = None
+        self.__wrench_hrep = None
+        self.__wrench_span = None
+
+    @property
+    def friction(self):
+        """
+        Static friction coefficient.
+        """
+        return self.__friction
+
+    @friction.setter
+    def friction(self, friction):
+        self.__friction = friction
+        self.__inner_mu = None  # inner approximation of the friction cone
+        if friction is not None:
+            self.__inner_mu = friction / sqrt(2)
+        self.__local_cone = None
+        self.__reset_cache()
+
+    @property
+    def max_pressure(self):
+        """
+        Maximum pressure on contact, or ``None`` if unbounded.
+        """
+        return self.__max_pressure
+
+    @max_pressure.setter
+    def max_pressure(self, max_pressure):
+        self.__max_pressure = max_pressure
+        self.__wrench_hrep = None
+
+    @property
+    def shape(self):
+        """
+        Surface dimensions (half-length, half-width) in [m].
+        """
+        return self.__shape
+
+    @shape.setter
+    def shape(self, shape):
+        self.__shape = shape
+        self.__local_cone = None
+        self.__reset_cache()
+
     @property
     def dict_repr(self):
         return {
@@ -130,13 +300,16 @@ class Contact(Box):
         All linearized friction cones in pymanoid use the inner (conservative)
         approximation. See <https://scaron.info/teaching/friction-cones.html>.
         """
-        mu = self.friction / sqrt(2)
-        hrep_local = array([
-            [-1, 0, -mu],
-            [+1, 0, -mu],
-            [0, -1, -mu],
-            [0, +1, -mu]])
-        return dot(hrep_local, self.R.T)
+        self.__check_pose()
+        if self.__force_inequalities is None:
+            mu = self.__inner_mu
+            hrep_local = array([
+                [-1, 0, -mu],
+                [+1, 0, -mu],
+                [0, -1, -mu],
+                [0, +1, -mu]])
+            self.__force_inequalities = dot(hrep_local, self.__RT)
+        return self.__force_inequalities
 
     @property
     def force_rays(self):
@@ -148,12 +321,7 @@ class Contact(Box):
         All linearized friction cones in pymanoid use the inner (conservative)
         approximation. See <https://scaron.info/teaching/friction-cones.html>.
         """
-        mu = self.friction / sqrt(2)
-        f1 = dot(self.R, [+mu, +mu, +1])
-        f2 = dot(self.R, [+mu, -mu, +1])
-        f3 = dot(self.R, [-mu, +mu, +1])
-        f4 = dot(self.R, [-mu, -mu, +1])
-        return [f1, f2, f3, f4]
+        return list(self.force_span.T)
 
     @property
     def force_span(self):
@@ -171,7 +339,10 @@ class Contact(Box):
         All linearized friction cones in pymanoid use the inner (conservative)
         approximation. See <https://scaron.info/teaching/friction-cones.html>.
         """
-        return array(self.force_rays).T
+        self.__check_pose()
+        if self.__force_span is None:
+            self.__force_span = _force_span(self.__R, self.__inner_mu)
+        return self.__force_span
 
     def compute_grasp_matrix(self, p):
         """
@@ -196,15 +367,7 @@ class Contact(Box):
         G : ndarray
             Grasp matrix :math:`G_P`.
         """
-        x, y, z = self.p - p
-        return array([
-            # fx fy  fz taux tauy tauz
-            [1,   0,  0,   0,   0,   0],
-            [0,   1,  0,   0,   0,   0],
-            [0,   0,  1,   0,   0,   0],
-            [0,  -z,  y,   1,   0,   0],
-            [z,   0, -x,   0,   1,   0],
-            [-y,  x,  0,   0,   0,   1]])
+        return _grasp_matrix(self.p - p)
 
     @property
     def vertices(self):
@@ -229,11 +392,12 @@ class Contact(Box):
         """
         X = scale * self.shape[0]
         Y = scale * self.shape[1]
-        v1 = dot(self.T, array([+X, +Y, 0., 1.]))[:3]
-        v2 = dot(self.T, array([+X, -Y, 0., 1.]))[:3]
-        v3 = dot(self.T, array([-X, -Y, 0., 1.]))[:3]
-        v4 = dot(self.T, array([-X, +Y, 0., 1.]))[:3]
-        return [v1, v2, v3, v4]
+        local_vertices = array([  # one column per vertex
+            [+X, +X, -X, -X],
+            [+Y, -Y, -Y, +Y],
+            [0., 0., 0., 0.],
+            [1., 1., 1., 1.]])
+        return list(dot(self.T[:3], local_vertices).T)
 
     def set_wrench(self, wrench):
         """
@@ -255,7 +419,10 @@ class Contact(Box):
         if not self.is_managed:
             self.set_color('b')
         self.is_managed = True
-        self.wrench = dot(block_diag(self.R, self.R), wrench)
+        R = self.R
+        self.wrench = empty(6)
+        self.wrench[:3] = dot(R, wrench[:3])
+        self.wrench[3:] = dot(R, wrench[3:])
 
     def unset_wrench(self):
         """
@@ -282,10 +449,11 @@ class Contact(Box):
         """
         if self.wrench is None:
             return None
-        X_world_point = vstack([
-            hstack([eye(3), eye(3)]),
-            hstack([crossmat(point), eye(3)])])
-        return dot(X_world_point, self.wrench)
+        f, tau = self.wrench[:3], self.wrench[3:]
+        w_P = empty(6)
+        w_P[:3] = f
+        w_P[3:] = tau + cross(self.p - point, f)
+        return w_P
 
     @property
     def wrench_inequalities(self):
@@ -303,27 +471,16 @@ class Contact(Box):
         the world frame. See [Caron15]_ for the derivation of the formula for
         `F`.
         """
-        X, Y = self.shape
-        mu = self.friction / sqrt(2)  # inner approximation
-        local_cone = array([
-            # fx fy             fz taux tauy tauz
-            [-1,  0,           -mu,   0,   0,   0],
-            [+1,  0,           -mu,   0,   0,   0],
-            [0,  -1,           -mu,   0,   0,   0],
-            [0,  +1,           -mu,   0,   0,   0],
-            [0,   0,            -Y,  -1,   0,   0],
-            [0,   0,            -Y,  +1,   0,   0],
-            [0,   0,            -X,   0,  -1,   0],
-            [0,   0,            -X,   0,  +1,   0],
-            [-Y, -X, -(X + Y) * mu, +mu, +mu,  -1],
-            [-Y, +X, -(X + Y) * mu, +mu, -mu,  -1],
-            [+Y, -X, -(X + Y) * mu, -mu, +mu,  -1],
-            [+Y, +X, -(X + Y) * mu, -mu, -mu,  -1],
-            [+Y, +X, -(X + Y) * mu, +mu, +mu,  +1],
-            [+Y, -X, -(X + Y) * mu, +mu, -mu,  +1],
-            [-Y, +X, -(X + Y) * mu, -mu, +mu,  +1],
-            [-Y, -X, -(X + Y) * mu, -mu, -mu,  +1]])
-        return dot(local_cone, block_diag(self.R.T, self.R.T))
+        self.__check_pose()
+        if self.__F is None:
+            if self.__local_cone is None:
+                X, Y = self.shape
+                self.__local_cone = _local_wrench_cone(X, Y, self.__inner_mu)
+            # force and moment halves of each row are rotated by the same
+            # matrix, i.e. F = local_cone * block_diag(R.T, R.T)
+            self.__F = dot(
+                self.__local_cone.reshape((32, 3)), self.__RT).reshape((16, 6))
+        return self.__F
 
     @property
     def wrench_hrep(self):
@@ -342,25 +499,25 @@ class Contact(Box):
         the world frame. See [Caron15]_ for the derivation of the formula for
         `F`.
         """
-        if self.max_pressure is None:
-            F = self.wrench_inequalities
-            b = zeros(F.shape[0])
-        else:  # self.max_pressure is not None
-            pressure_select = hstack([self.n, zeros(3)])
-            F = vstack([self.wrench_inequalities, pressure_select])
-            b = zeros(F.shape[0])
-            b[-1] = self.max_pressure
-        return (F, b)
+        self.__check_pose()
+        if self.__wrench_hrep is None:
+            if self.max_pressure is None:
+                F = self.wrench_inequalities
+                b = zeros(F.shape[0])
+            else:  # self.max_pressure is not None
+                pressure_select = hstack([self.__R[:, 2], zeros(3)])
+                F = vstack([self.wrench_inequalities, pressure_select])
+                b = zeros(F.shape[0])
+                b[-1] = self.max_pressure
+            self.__wrench_hrep = (F, b)
+        return self.__wrench_hrep
 
     @property
     def wrench_rays(self):
         """
         Rays (V-rep) of the contact wrench cone in world frame.
         """
-        return [
-            hstack([f, cross(v - self.p, f)])
-            for v in self.vertices
-            for f in self.force_rays]
+        return list(self.wrench_span.T)
 
     @property
     def wrench_span(self):
@@ -389,9 +546,11 @@ class Contact(Box):
         contact points (one for each vertex of the rectangular area) with
         4-sided friction pyramids at each.
         """
-        return hstack([
-            dot(vstack([eye(3), crossmat(v - self.p)]), self.force_span)
-            for v in self.vertices])
+        self.__check_pose()
+        if self.__wrench_span is None:
+            X, Y = self.shape
+            self.__wrench_span = _wrench_span(self.__R, X, Y, self.__inner_mu)
+        return self.__wrench_span
 
 
 class ContactSet(object):
@@ -426,7 +585,8 @@ class ContactSet(object):
             the stacked vector of contact wrenches (each wrench being taken at
             its respective contact point and in the world frame).
         """
-        return hstack([c.compute_grasp_matrix(p) for c in self.contacts])
+        arms = array([contact.p for contact in self.contacts]) - p
+        return _grasp_matrices(arms)
 
     def compute_static_equilibrium_polygon(self, method='hull'):
         """
@@ -451,19 +611,20 @@ class ContactSet(object):
         """
         if method == 'hull':
             A_O = self.compute_wrench_inequalities([0, 0, 0])
-            k, a_Oz, a_x, a_y = A_O.shape[0], A_O[:, 2], A_O[:, 3], A_O[:, 4]
-            B, c = hstack([-a_y.reshape((k, 1)), +a_x.reshape((k, 1))]), -a_Oz
+            B, c = A_O[:, (4, 3)] * [-1., +1.], -A_O[:, 2]  # [-a_y, +a_x]
             return compute_polygon_hull(B, c)
         G_0 = self.compute_grasp_matrix([0., 0., 0.])
-        F = block_diag(*[ct.wrench_inequalities for ct in self.contacts])
+        F = _block_diag(array([
+            contact.wrench_inequalities for contact in self.contacts]))
         mass = 42.  # [kg]
         # mass has no effect on the output polygon, see IV.B in [Caron16]_
-        E = 1. / (mass * 9.81) * vstack([-G_0[4, :], +G_0[3, :]])
+        weight = mass * gravity_const
+        E = 1. / weight * vstack([-G_0[4, :], +G_0[3, :]])
         f = array([0., 0.])
         return project_polytope(
             proj=(E, f),
             ineq=(F, zeros(F.shape[0])),
-            eq=(G_0[(0, 1, 2, 5), :], array([0, 0, mass * 9.81, 0])),
+            eq=(G_0[(0, 1, 2, 5), :], array([0, 0, weight, 0])),
             method=method)
 
     def compute_wrench_inequalities(self, p):
@@ -510,18 +671,12 @@ class ContactSet(object):
 
         where :math:`w_P` denotes the contact-wrench coordinates at point `P`.
         """
-        span_blocks = []
-        for contact in self.contacts:
-            x, y, z = contact.p - p
-            Gi = array([
-                [1,  0,  0, 0, 0, 0],
-                [0,  1,  0, 0, 0, 0],
-                [0,  0,  1, 0, 0, 0],
-                [0, -z,  y, 1, 0, 0],
-                [z,  0, -x, 0, 1, 0],
-                [-y, x,  0, 0, 0, 1]])
-            span_blocks.append(dot(Gi, contact.wrench_span))
-        S = hstack(span_blocks)
+        contacts = self.contacts
+        spans = array([contact.wrench_span for contact in contacts])
+        arms = array([contact.p for contact in contacts]) - p
+        # moments of the force columns of all contacts, taken at p
+        spans[:, 3:, :] += cross(arms[:, :, None], spans[:, :3, :], axis=1)
+        S = spans.transpose((1, 0, 2)).reshape((6, -1))
         assert S.shape == (6, 16 * self.nb_contacts)
         return S
 
@@ -559,7 +714,9 @@ class ContactSet(object):
         (:math:`w^i_{C_i}`), not at the point `P` where the net wrench
         :math:`w_P` is given.
         """
-        n = 6 * len(self.supporting_contacts)
+        supporting_contacts = self.supporting_contacts
+        nb_supporting = len(supporting_contacts)
+        n = 6 * nb_supporting
         ext_wrench = zeros(6)
         for contact in self.contacts:
             if contact.is_managed and contact.wrench is not None:
@@ -567,24 +724,24 @@ class ContactSet(object):
         epsilon = min(friction_weight, cop_weight, yaw_weight) * 1e-3
         W_f = diag([friction_weight, friction_weight, epsilon])
         W_tau = diag([cop_weight, cop_weight, yaw_weight])
-        P = block_diag(*[
-            block_diag(
-                dot(contact.R, dot(W_f, contact.R.T)),
-                dot(contact.R, dot(W_tau, contact.R.T)))
-            for contact in self.supporting_contacts])
+        P = zeros((n, n))
+        G = zeros((16 * nb_supporting, n))
+        for i, contact in enumerate(supporting_contacts):
+            j, k, R = 6 * i, 16 * i, contact.R
+            P[j:j + 3, j:j + 3] = dot(R, dot(W_f, R.T))
+            P[j + 3:j + 6, j + 3:j + 6] = dot(R, dot(W_tau, R.T))
+            G[k:k + 16, j:j + 6] = contact.wrench_inequalities
         q = zeros((n,))
-        G = block_diag(*[contact.wrench_inequalities
-                         for contact in self.supporting_contacts])
         h = zeros((G.shape[0],))  # G * x <= h
-        A = hstack([contact.compute_grasp_matrix(point)
-                    for contact in self.supporting_contacts])
+        A = _grasp_matrices(
+            array([contact.p for contact in supporting_contacts]) - point)
         b = wrench + ext_wrench  # A * x == b
         w_all = solve_qp(P, q, G, h, A, b, solver=solver)
         if w_all is None:
             return None
         support = [
             (contact, w_all[6 * i:6 * (i + 1)])
-            for i, contact in enumerate(self.contacts)]
+            for i, contact in enumerate(supporting_contacts)]
         return support
 
     @property
@@ -643,10 +800,13 @@ class ContactFeed(object):
         return self.contacts[i]
 
     def load(self, path):
-        import simplejson
         assert path.endswith('.json')
-        with open(path, 'r') as fp:
-            contact_defs = simplejson.load(fp)
+        if orjson is not None:
+            with open(path, 'rb') as fp:
+                contact_defs = orjson.loads(fp.read())
+        else:  # fall back to the standard library
+            with open(path, 'r') as fp:
+                contact_defs = json.load(fp)
         for d in contact_defs:
             self.contacts.append(Contact(
                 shape=d['shape'],
@@ -656,15 +816,20 @@ class ContactFeed(object):
         self.__path = path
 
     def save(self, path=None):
-        import simplejson
         if path is None:
             path = self.__path
         assert path.endswith('.json')
         contact_defs = [{
-            'shape': contact.shape,
-            'pos': list(contact.p),
-            'rpy': list(contact.rpy),
+            'shape': list(contact.shape),
+            'pos': contact.p.tolist(),
+            'rpy': contact.rpy.tolist(),
             'friction': contact.friction}
             for contact in self.contacts]
-        with open(path, 'w') as fp:
-            simplejson.dump(contact_defs, fp, indent=4, sort_keys=True)
+        if orjson is not None:
+            options = orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY \
+                | orjson.OPT_SORT_KEYS
+            with open(path, 'wb') as fp:
+                fp.write(orjson.dumps(contact_defs, option=options))
+        else:  # fall back to the standard library
+            with open(path, 'w') as fp:
+                json.dump(contact_defs, fp, indent=4, sort_keys=True)
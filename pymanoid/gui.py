@@ -308,14 +308,15 @@ def draw_polygon(points, normal, combined='g-#', color=None, faces=None,
     t = array([n[2] - n[1], n[0] - n[2], n[1] - n[0]], dtype=float)
     t /= norm(t)
     b = cross(n, t)
-    points2d = [[dot(t, x), dot(b, x)] for x in points]
+    points3d = array(points, dtype=float).reshape((-1, 3))
+    points2d = dot(points3d, vstack([t, b]).T)
     try:
         hull = ConvexHull(points2d)
     except QhullError:
         warn("QhullError: maybe polygon is empty?")
         return []
-    except IndexError:
-        warn("Qhull raised an IndexError for points2d=%s" % repr(points2d))
+    except (IndexError, ValueError) as e:
+        warn("Qhull raised %s for points2d=%s" % (repr(e), repr(points2d)))
         return []
     return draw_polytope(
         points, combined, color, faces, linewidth, pointsize, hull=hull)
@@ -284,7 +284,7 @@ class Stance(ContactSet):
         c = hstack(c_list)
         try:
             g = -gravity[2]  # gravity constant (positive)
-            B_2d = hstack([B[:, j].reshape((B.shape[0], 1)) for j in [0, 1]])
+            B_2d = B[:, :2]
             sigma = c / g  # see Equation (30) in [CK16]
             reduced_hull = compute_polygon_hull(B_2d, sigma)
             if reduced: